@@ -23,38 +23,43 @@ def main():
     # Initialiser l'agent BigQuery
     bq_agent = BigQueryAgent(project_id=project_id)
 
-    # Obtenir la question de l'utilisateur pour la requête de données
+    dashboard_agent = None
+
+    # Les questions suivantes réutilisent le même agent et donc sa mémoire de session
+    # (tables, schémas et requêtes déjà découverts)
     natural_language_query = input("Posez votre question (ex: 'donne moi le nombre de vues par vidéo') : ")
+    while natural_language_query.strip():
+        # L'agent va automatiquement découvrir les tables et exécuter la requête
+        print("\n--- L'agent analyse votre question et explore BigQuery ---")
+        results_df = bq_agent.query(natural_language_query)
 
-    # L'agent va automatiquement découvrir les tables et exécuter la requête
-    print("\n--- L'agent analyse votre question et explore BigQuery ---")
-    results_df = bq_agent.query(natural_language_query)
-
-    # Vérifier si nous avons des résultats
-    if results_df.empty or 'error' in results_df.columns or 'message' in results_df.columns:
-        print("\nAucune donnée n'a été récupérée ou une erreur s'est produite.")
-        if 'error' in results_df.columns:
-            print(f"Erreur: {results_df['error'].iloc[0]}")
-        elif 'message' in results_df.columns:
-            print(f"Message: {results_df['message'].iloc[0]}")
-        return
+        # Vérifier si nous avons des résultats
+        if results_df.empty or 'error' in results_df.columns or 'message' in results_df.columns:
+            print("\nAucune donnée n'a été récupérée ou une erreur s'est produite.")
+            if 'error' in results_df.columns:
+                print(f"Erreur: {results_df['error'].iloc[0]}")
+            elif 'message' in results_df.columns:
+                print(f"Message: {results_df['message'].iloc[0]}")
+        else:
+            print("\n--- Résultats de la requête ---")
+            print(results_df)
 
-    print("\n--- Résultats de la requête ---")
-    print(results_df)
+            # --- Étape 2: Proposer et interagir avec l'agent de Tableau de Bord ---
+            visualize_choice = input("\nVoulez-vous visualiser ces résultats dans un tableau de bord ? (oui/non): ").lower()
+            if visualize_choice in ['oui', 'o', 'yes', 'y']:
+                print("\n--- Création de la Visualisation ---")
 
-    # --- Étape 2: Proposer et interagir avec l'agent de Tableau de Bord ---
-    visualize_choice = input("\nVoulez-vous visualiser ces résultats dans un tableau de bord ? (oui/non): ").lower()
-    if visualize_choice in ['oui', 'o', 'yes', 'y']:
-        print("\n--- Création de la Visualisation ---")
+                # Initialiser l'agent de tableau de bord
+                if dashboard_agent is None:
+                    dashboard_agent = DashboardAgent()
 
-        # Initialiser l'agent de tableau de bord
-        dashboard_agent = DashboardAgent()
+                # Utiliser la question originale comme description pour la visualisation
+                print(f"Utilisation de la description : '{natural_language_query}' pour générer le graphique.")
+                dashboard_agent.create_visualization(results_df, natural_language_query)
+            else:
+                print("La création de la visualisation a été ignorée.")
 
-        # Utiliser la question originale comme description pour la visualisation
-        print(f"Utilisation de la description : '{natural_language_query}' pour générer le graphique.")
-        dashboard_agent.create_visualization(results_df, natural_language_query)
-    else:
-        print("La création de la visualisation a été ignorée.")
+        natural_language_query = input("\nQuestion suivante (Entrée pour terminer) : ")
 
     print("\n--- Processus Terminé ---")
 
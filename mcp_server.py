@@ -8,8 +8,6 @@ Pour BigQuery, nous utilisons seulement les capacités d'exploration et d'exécu
 """
 
 import asyncio
-import os
-import json
 from typing import Any
 from dotenv import load_dotenv
 
@@ -21,6 +19,17 @@ from google.cloud import bigquery
 import pandas as pd
 import plotly.express as px
 
+from src.resilience import MetadataResilience
+from src.sql_analyzer import TableMetadataCache, analyze_sql, describe_table_layout
+from src.table_listing import (
+    DatasetTablesCache,
+    format_table_listing,
+    get_project_ids,
+    list_all_tables,
+    list_dataset_tables,
+    list_project_datasets,
+)
+
 load_dotenv()
 
 # Initialiser le serveur MCP
@@ -30,16 +39,70 @@ app = Server("bigquery-dashboard-agent")
 bq_client = None
 last_query_result = None
 
+# Téléchargement en arrière-plan du résultat complet de la dernière requête
+last_query_download = None
+
+# Nombre de lignes de l'aperçu, renvoyé dès réception de la première page de résultats
+PREVIEW_ROWS = 10
+
+# Projets BigQuery explorables (GOOGLE_CLOUD_PROJECT_ID + GOOGLE_CLOUD_PROJECT_IDS)
+project_ids = []
+
+# Reprises, hedging et disjoncteur des appels de métadonnées
+metadata_resilience = MetadataResilience()
+
+# Cache des métadonnées de tables (schéma, partitionnement, clustering)
+table_cache = TableMetadataCache(resilience=metadata_resilience)
+
+# Cache des listes de tables par dataset
+dataset_tables_cache = DatasetTablesCache(resilience=metadata_resilience)
+
 
 def initialize_bigquery_client():
     """Initialise le client BigQuery."""
-    global bq_client
+    global bq_client, project_ids
 
-    project_id = os.getenv("GOOGLE_CLOUD_PROJECT_ID")
-    if not project_id:
+    project_ids = get_project_ids()
+    if not project_ids:
         raise ValueError("GOOGLE_CLOUD_PROJECT_ID doit être défini dans les variables d'environnement.")
 
-    bq_client = bigquery.Client(project=project_id)
+    # Le premier projet est utilisé pour la facturation des requêtes
+    bq_client = bigquery.Client(project=project_ids[0])
+
+
+async def report_progress(progress, total=None):
+    """Envoie une notification de progression MCP si le client en a demandé une (progressToken)."""
+    try:
+        ctx = app.request_context
+    except LookupError:
+        return
+    token = ctx.meta.progressToken if ctx.meta is not None else None
+    if token is not None:
+        await ctx.session.send_progress_notification(token, progress, total)
+
+
+async def download_query_result(query_job):
+    """Télécharge le résultat complet d'une requête et le stocke pour la visualisation."""
+    global last_query_result
+
+    df = await asyncio.to_thread(query_job.to_dataframe)
+    last_query_result = df
+    return df
+
+
+def _retrieve_download_error(task):
+    """Récupère l'erreur d'un téléchargement jamais attendu (ex: remplacé par une autre requête)."""
+    if not task.cancelled():
+        task.exception()
+
+
+def _cancel_pending_download():
+    """Annule le téléchargement en arrière-plan d'un résultat devenu obsolète."""
+    global last_query_download
+
+    if last_query_download is not None and not last_query_download.done():
+        last_query_download.cancel()
+    last_query_download = None
 
 
 @app.list_tools()
@@ -51,7 +114,12 @@ async def list_tools() -> list[Tool]:
             description="Liste tous les datasets disponibles dans le projet BigQuery.",
             inputSchema={
                 "type": "object",
-                "properties": {},
+                "properties": {
+                    "project_id": {
+                        "type": "string",
+                        "description": "Le projet à explorer (défaut: projet principal)"
+                    }
+                },
                 "required": []
             }
         ),
@@ -63,12 +131,30 @@ async def list_tools() -> list[Tool]:
                 "properties": {
                     "dataset_id": {
                         "type": "string",
-                        "description": "L'ID du dataset à explorer"
+                        "description": "L'ID du dataset à explorer (ou project.dataset)"
                     }
                 },
                 "required": ["dataset_id"]
             }
         ),
+        Tool(
+            name="list_all_tables",
+            description=(
+                "Liste en une seule fois toutes les tables de tous les datasets des projets "
+                "BigQuery configurés. À privilégier pour une première exploration."
+            ),
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "project_ids": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Les projets à explorer (défaut: tous les projets configurés)"
+                    }
+                },
+                "required": []
+            }
+        ),
         Tool(
             name="get_table_schema",
             description="Récupère le schéma détaillé d'une table BigQuery (colonnes, types, descriptions).",
@@ -82,6 +168,10 @@ async def list_tools() -> list[Tool]:
                     "table_id": {
                         "type": "string",
                         "description": "L'ID de la table"
+                    },
+                    "project_id": {
+                        "type": "string",
+                        "description": "Le projet contenant le dataset (défaut: projet principal)"
                     }
                 },
                 "required": ["dataset_id", "table_id"]
@@ -91,7 +181,8 @@ async def list_tools() -> list[Tool]:
             name="execute_bigquery_sql",
             description=(
                 "Exécute une requête SQL sur BigQuery et retourne les résultats. "
-                "Utilisez le format complet: project.dataset.table dans les requêtes."
+                "Utilisez le format complet: project.dataset.table dans les requêtes. "
+                "Les tables partitionnées doivent être filtrées sur leur colonne de partition."
             ),
             inputSchema={
                 "type": "object",
@@ -99,6 +190,13 @@ async def list_tools() -> list[Tool]:
                     "sql_query": {
                         "type": "string",
                         "description": "La requête SQL à exécuter sur BigQuery"
+                    },
+                    "preview": {
+                        "type": "boolean",
+                        "description": (
+                            "Requête exploratoire: ajoute un LIMIT et restreint les colonnes "
+                            "d'un SELECT * (défaut: false)"
+                        )
                     }
                 },
                 "required": ["sql_query"]
@@ -131,7 +229,7 @@ async def list_tools() -> list[Tool]:
 @app.call_tool()
 async def call_tool(name: str, arguments: Any) -> list[TextContent]:
     """Exécute un outil."""
-    global bq_client, last_query_result
+    global bq_client, last_query_result, last_query_download
 
     # Initialiser le client BigQuery si nécessaire
     if bq_client is None:
@@ -139,16 +237,23 @@ async def call_tool(name: str, arguments: Any) -> list[TextContent]:
 
     try:
         if name == "list_bigquery_datasets":
+            project_id = arguments.get("project_id") or bq_client.project
             try:
-                datasets = list(bq_client.list_datasets())
-                if not datasets:
+                # Les appels de métadonnées peuvent attendre (backoff, hedging): hors de la boucle
+                dataset_ids = await asyncio.to_thread(
+                    list_project_datasets, bq_client, project_id, dataset_tables_cache
+                )
+                if not dataset_ids:
                     return [TextContent(
                         type="text",
-                        text="Aucun dataset trouvé dans ce projet BigQuery."
+                        text=f"Aucun dataset trouvé dans le projet BigQuery '{project_id}'."
                     )]
 
-                dataset_list = [f"- {dataset.dataset_id}" for dataset in datasets]
-                result = "Datasets BigQuery disponibles:\n" + "\n".join(dataset_list)
+                dataset_list = [f"- {dataset_id}" for dataset_id in dataset_ids]
+                result = f"Datasets BigQuery disponibles dans '{project_id}':\n" + "\n".join(dataset_list)
+                other_projects = [p for p in project_ids if p != project_id]
+                if other_projects:
+                    result += f"\n\nAutres projets configurés: {', '.join(other_projects)}"
 
                 return [TextContent(type="text", text=result)]
             except Exception as e:
@@ -163,14 +268,17 @@ async def call_tool(name: str, arguments: Any) -> list[TextContent]:
                 return [TextContent(type="text", text="Erreur: dataset_id est requis.")]
 
             try:
-                tables = list(bq_client.list_tables(dataset_id))
-                if not tables:
+                dataset_ref = dataset_id if "." in dataset_id else f"{bq_client.project}.{dataset_id}"
+                table_ids = await asyncio.to_thread(
+                    list_dataset_tables, bq_client, dataset_ref, dataset_tables_cache
+                )
+                if not table_ids:
                     return [TextContent(
                         type="text",
                         text=f"Aucune table trouvée dans le dataset '{dataset_id}'."
                     )]
 
-                table_list = [f"- {table.table_id}" for table in tables]
+                table_list = [f"- {table_id}" for table_id in table_ids]
                 result = f"Tables dans le dataset '{dataset_id}':\n" + "\n".join(table_list)
 
                 return [TextContent(type="text", text=result)]
@@ -180,9 +288,30 @@ async def call_tool(name: str, arguments: Any) -> list[TextContent]:
                     text=f"Erreur lors de la récupération des tables: {e}"
                 )]
 
+        elif name == "list_all_tables":
+            selected_projects = arguments.get("project_ids") or project_ids
+            try:
+                # Les appels bloquants sont répartis sur un pool de threads
+                listing, errors = await asyncio.to_thread(
+                    list_all_tables, bq_client, selected_projects, dataset_tables_cache
+                )
+                if not listing and not errors:
+                    return [TextContent(
+                        type="text",
+                        text=f"Aucun dataset trouvé dans les projets: {', '.join(selected_projects)}."
+                    )]
+
+                return [TextContent(type="text", text=format_table_listing(listing, errors))]
+            except Exception as e:
+                return [TextContent(
+                    type="text",
+                    text=f"Erreur lors du listing des tables: {e}"
+                )]
+
         elif name == "get_table_schema":
             dataset_id = arguments.get("dataset_id")
             table_id = arguments.get("table_id")
+            project_id = arguments.get("project_id") or bq_client.project
 
             if not dataset_id or not table_id:
                 return [TextContent(
@@ -191,8 +320,8 @@ async def call_tool(name: str, arguments: Any) -> list[TextContent]:
                 )]
 
             try:
-                full_table_id = f"{bq_client.project}.{dataset_id}.{table_id}"
-                table = bq_client.get_table(full_table_id)
+                full_table_id = f"{project_id}.{dataset_id}.{table_id}"
+                table = await asyncio.to_thread(table_cache.get_table, bq_client, full_table_id)
 
                 schema_info = []
                 for field in table.schema:
@@ -202,6 +331,8 @@ async def call_tool(name: str, arguments: Any) -> list[TextContent]:
 
                 result = f"Schéma de la table '{full_table_id}':\n"
                 result += f"Nombre de lignes: {table.num_rows:,}\n"
+                for line in describe_table_layout(table):
+                    result += f"{line}\n"
                 result += "Colonnes:\n" + "\n".join(schema_info)
 
                 return [TextContent(type="text", text=result)]
@@ -217,28 +348,62 @@ async def call_tool(name: str, arguments: Any) -> list[TextContent]:
                 return [TextContent(type="text", text="Erreur: sql_query est requis.")]
 
             try:
-                query_job = bq_client.query(sql_query)
-                results = query_job.result()
-                df = results.to_dataframe()
-
-                if df.empty:
+                # L'analyse lit les métadonnées (backoff, hedging): hors de la boucle d'événements
+                analysis = await asyncio.to_thread(
+                    analyze_sql, sql_query, bq_client, table_cache,
+                    preview=bool(arguments.get("preview")),
+                )
+                if analysis.rejected:
                     return [TextContent(
                         type="text",
-                        text="La requête a été exécutée mais n'a retourné aucun résultat."
+                        text=f"❌ Requête refusée avant exécution:\n{analysis.rejection_reason}"
                     )]
-
-                # Stocker le résultat pour une visualisation ultérieure
-                last_query_result = df
+                notes = analysis.format_notes()
+
+                query_job = await asyncio.to_thread(bq_client.query, analysis.sql)
+                results = await asyncio.to_thread(query_job.result, page_size=PREVIEW_ROWS)
+
+                # Seule la première page est attendue: la latence de l'aperçu ne dépend
+                # pas de la taille totale du résultat
+                first_page = await asyncio.to_thread(next, iter(results.pages), None)
+                rows = list(first_page) if first_page is not None else []
+                total_rows = results.total_rows or len(rows)
+
+                if not rows:
+                    text = "La requête a été exécutée mais n'a retourné aucun résultat."
+                    if notes:
+                        text += f"\n\n{notes}"
+                    return [TextContent(type="text", text=text)]
+
+                await report_progress(len(rows), total_rows)
+
+                columns = [field.name for field in results.schema]
+                preview_df = pd.DataFrame([row.values() for row in rows], columns=columns)
+
+                _cancel_pending_download()
+                if total_rows <= len(rows):
+                    # La première page contient tout le résultat: rien à télécharger
+                    last_query_result = preview_df
+                else:
+                    # Le résultat complet est téléchargé en arrière-plan pour une visualisation ultérieure
+                    last_query_result = None
+                    last_query_download = asyncio.create_task(download_query_result(query_job))
+                    last_query_download.add_done_callback(_retrieve_download_error)
 
                 # Formater les résultats
                 result_text = f"✅ Requête exécutée avec succès!\n\n"
-                result_text += f"Nombre de lignes: {len(df):,}\n"
-                result_text += f"Colonnes: {', '.join(df.columns)}\n\n"
-                result_text += "Aperçu des données (10 premières lignes):\n"
-                result_text += df.head(10).to_string(index=False)
-
-                if len(df) > 10:
-                    result_text += f"\n\n... et {len(df) - 10} lignes supplémentaires"
+                if notes:
+                    result_text += f"{notes}\n\n"
+                result_text += f"Nombre de lignes: {total_rows:,}\n"
+                result_text += f"Colonnes: {', '.join(columns)}\n\n"
+                result_text += f"Aperçu des données ({PREVIEW_ROWS} premières lignes):\n"
+                result_text += preview_df.head(PREVIEW_ROWS).to_string(index=False)
+
+                if total_rows > PREVIEW_ROWS:
+                    result_text += (
+                        f"\n\n... et {total_rows - PREVIEW_ROWS:,} lignes supplémentaires "
+                        f"(téléchargement complet en arrière-plan)"
+                    )
 
                 return [TextContent(type="text", text=result_text)]
             except Exception as e:
@@ -252,6 +417,16 @@ async def call_tool(name: str, arguments: Any) -> list[TextContent]:
             if not plotly_code:
                 return [TextContent(type="text", text="Erreur: plotly_code est requis.")]
 
+            # Attendre la fin du téléchargement en arrière-plan du dernier résultat
+            if last_query_download is not None:
+                try:
+                    await last_query_download
+                except Exception as e:
+                    return [TextContent(
+                        type="text",
+                        text=f"❌ Erreur lors du téléchargement du résultat complet:\n{e}"
+                    )]
+
             if last_query_result is None or last_query_result.empty:
                 return [TextContent(
                     type="text",
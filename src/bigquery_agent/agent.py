@@ -1,19 +1,49 @@
+import asyncio
+import functools
 import os
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from google.cloud import bigquery
 from langchain.agents import AgentExecutor, create_tool_calling_agent
 from langchain.tools import tool
+from langchain_core.tools import StructuredTool
 from langchain_core.prompts import ChatPromptTemplate
 import pandas as pd
 from ..llm_config import get_llm, get_provider_info
+from ..resilience import MetadataResilience
+from ..sql_analyzer import TableMetadataCache, analyze_sql, describe_table_layout
+from ..table_listing import (
+    DatasetTablesCache,
+    format_table_listing,
+    get_project_ids,
+    list_all_tables as list_tables_in_projects,
+    list_dataset_tables,
+    list_project_datasets,
+)
+from .session import AgentSession
+from .timing import ToolTurnTimer
 
 load_dotenv()
 
+# Nombre de threads utilisés pour exécuter en parallèle les appels d'outils d'un même tour
+TOOL_MAX_WORKERS = int(os.getenv("BIGQUERY_AGENT_TOOL_WORKERS", "8"))
+
 
 class BigQueryAgent:
-    def __init__(self, project_id):
+    def __init__(self, project_id, project_ids=None, concurrent_tools=True, session=None):
         self.project_id = project_id
+        # Contexte d'exploration réutilisé d'une question à l'autre
+        self.session = session or AgentSession()
+        # Exécuter en parallèle les appels d'outils émis par le LLM dans un même tour
+        self.concurrent_tools = concurrent_tools
+        self._tool_executor = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS)
+        # Projets explorables en plus du projet principal (GOOGLE_CLOUD_PROJECT_IDS par défaut)
+        self.project_ids = project_ids or get_project_ids(project_id)
         self.client = bigquery.Client(project=self.project_id)
+        # Reprises, hedging et disjoncteur partagés par les appels de métadonnées
+        self.metadata_resilience = MetadataResilience()
+        self.table_cache = TableMetadataCache(resilience=self.metadata_resilience)
+        self.dataset_tables_cache = DatasetTablesCache(resilience=self.metadata_resilience)
 
         # Initialiser le modèle LLM dynamiquement selon la configuration
         print(f"🤖 Utilisation du modèle: {get_provider_info()}")
@@ -29,18 +59,30 @@ class BigQueryAgent:
         """Crée les outils que l'agent peut utiliser pour interagir avec BigQuery."""
 
         client = self.client  # Capture pour la closure
+        table_cache = self.table_cache
+        dataset_tables_cache = self.dataset_tables_cache
+        project_ids = self.project_ids
 
         @tool
-        def list_datasets() -> str:
-            """Liste tous les datasets disponibles dans le projet BigQuery.
-            Utilisez cet outil pour découvrir quels datasets sont disponibles."""
-            try:
-                datasets = list(client.list_datasets())
-                if not datasets:
-                    return "Aucun dataset trouvé dans ce projet."
+        def list_datasets(project_id: str = "") -> str:
+            """Liste tous les datasets disponibles dans un projet BigQuery.
+            Utilisez cet outil pour découvrir quels datasets sont disponibles.
 
-                dataset_list = [f"- {dataset.dataset_id}" for dataset in datasets]
-                return "Datasets disponibles:\n" + "\n".join(dataset_list)
+            Args:
+                project_id: Le projet à explorer (défaut: projet principal).
+            """
+            project_id = project_id or client.project
+            try:
+                dataset_ids = list_project_datasets(client, project_id, dataset_tables_cache)
+                if not dataset_ids:
+                    return f"Aucun dataset trouvé dans le projet '{project_id}'."
+
+                dataset_list = [f"- {dataset_id}" for dataset_id in dataset_ids]
+                result = f"Datasets disponibles dans '{project_id}':\n" + "\n".join(dataset_list)
+                other_projects = [p for p in project_ids if p != project_id]
+                if other_projects:
+                    result += f"\n\nAutres projets configurés: {', '.join(other_projects)}"
+                return result
             except Exception as e:
                 return f"Erreur lors de la récupération des datasets: {e}"
 
@@ -49,29 +91,49 @@ class BigQueryAgent:
             """Liste toutes les tables dans un dataset BigQuery spécifique.
 
             Args:
-                dataset_id: L'ID du dataset à explorer.
+                dataset_id: L'ID du dataset à explorer (ou project.dataset).
             """
             try:
-                tables = list(client.list_tables(dataset_id))
-                if not tables:
+                dataset_ref = dataset_id if "." in dataset_id else f"{client.project}.{dataset_id}"
+                table_ids = list_dataset_tables(client, dataset_ref, dataset_tables_cache)
+                if not table_ids:
                     return f"Aucune table trouvée dans le dataset '{dataset_id}'."
 
-                table_list = [f"- {table.table_id}" for table in tables]
+                self.session.record_tables(dataset_ref, table_ids)
+
+                table_list = [f"- {table_id}" for table_id in table_ids]
                 return f"Tables dans le dataset '{dataset_id}':\n" + "\n".join(table_list)
             except Exception as e:
                 return f"Erreur lors de la récupération des tables du dataset '{dataset_id}': {e}"
 
         @tool
-        def get_table_schema(dataset_id: str, table_id: str) -> str:
+        def list_all_tables() -> str:
+            """Liste en une seule fois toutes les tables de tous les datasets des projets configurés.
+            Utilisez cet outil en premier pour obtenir une vue d'ensemble des données."""
+            try:
+                listing, errors = list_tables_in_projects(client, project_ids, dataset_tables_cache)
+                if not listing and not errors:
+                    return f"Aucun dataset trouvé dans les projets: {', '.join(project_ids)}."
+
+                for dataset_ref, table_ids in listing.items():
+                    self.session.record_tables(dataset_ref, table_ids)
+                return format_table_listing(listing, errors)
+            except Exception as e:
+                return f"Erreur lors du listing des tables: {e}"
+
+        @tool
+        def get_table_schema(dataset_id: str, table_id: str, project_id: str = "") -> str:
             """Récupère le schéma d'une table BigQuery spécifique.
 
             Args:
                 dataset_id: L'ID du dataset contenant la table.
                 table_id: L'ID de la table dont on veut le schéma.
+                project_id: Le projet contenant le dataset (défaut: projet principal).
             """
             try:
-                full_table_id = f"{client.project}.{dataset_id}.{table_id}"
-                table = client.get_table(full_table_id)
+                full_table_id = f"{project_id or client.project}.{dataset_id}.{table_id}"
+                table = table_cache.get_table(client, full_table_id)
+                self.session.record_schema(full_table_id, table)
 
                 schema_info = []
                 for field in table.schema:
@@ -81,6 +143,8 @@ class BigQueryAgent:
 
                 result = f"Schéma de la table '{full_table_id}':\n"
                 result += f"Nombre de lignes: {table.num_rows}\n"
+                for line in describe_table_layout(table):
+                    result += f"{line}\n"
                 result += "Colonnes:\n" + "\n".join(schema_info)
 
                 return result
@@ -88,28 +152,62 @@ class BigQueryAgent:
                 return f"Erreur lors de la récupération du schéma de {dataset_id}.{table_id}: {e}"
 
         @tool
-        def execute_sql_query(sql_query: str) -> str:
+        def execute_sql_query(sql_query: str, preview: bool = False) -> str:
             """Exécute une requête SQL sur BigQuery et retourne un aperçu des résultats.
 
             Args:
                 sql_query: La requête SQL à exécuter.
+                preview: True pour une requête exploratoire (ajoute un LIMIT et
+                    restreint les colonnes d'un SELECT *).
             """
             try:
-                query_job = client.query(sql_query)
+                analysis = analyze_sql(sql_query, client, table_cache, preview=preview)
+                if analysis.rejected:
+                    return f"Requête refusée avant exécution: {analysis.rejection_reason}"
+                notes = analysis.format_notes()
+
+                query_job = client.query(analysis.sql)
                 results = query_job.result()
                 df = results.to_dataframe()
+                self.session.record_query(analysis.sql)
 
                 if df.empty:
-                    return "La requête n'a retourné aucun résultat."
+                    return f"La requête n'a retourné aucun résultat.\n{notes}".strip()
 
-                # Stocker le dataframe pour une utilisation ultérieure
-                self.last_query_result = df
+                # Stocker le dataframe par requête: les appels d'un même tour sont concurrents
+                self._query_results[sql_query] = df
 
-                return f"Requête exécutée avec succès. Aperçu des résultats:\n{df.head(10).to_string()}"
+                result = "Requête exécutée avec succès.\n"
+                if notes:
+                    result += f"{notes}\n"
+                return f"{result}Aperçu des résultats:\n{df.head(10).to_string()}"
             except Exception as e:
                 return f"Erreur lors de l'exécution de la requête SQL: {e}"
 
-        return [list_datasets, list_tables, get_table_schema, execute_sql_query]
+        sync_tools = [list_datasets, list_tables, list_all_tables, get_table_schema, execute_sql_query]
+        return [self._with_async_variant(sync_tool) for sync_tool in sync_tools]
+
+    def _with_async_variant(self, sync_tool):
+        """
+        Ajoute une variante asynchrone à un outil synchrone.
+
+        Le client BigQuery étant bloquant, la variante asynchrone exécute l'outil dans
+        le pool de threads de l'agent. L'AgentExecutor peut ainsi lancer simultanément
+        (via `ainvoke`) les appels d'outils émis par le LLM dans un même tour.
+        """
+        executor = self._tool_executor
+
+        async def run_in_thread_pool(**kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, functools.partial(sync_tool.func, **kwargs))
+
+        return StructuredTool.from_function(
+            func=sync_tool.func,
+            coroutine=run_in_thread_pool,
+            name=sync_tool.name,
+            description=sync_tool.description,
+            args_schema=sync_tool.args_schema,
+        )
 
     def _create_agent(self):
         """Crée l'agent LangChain avec les outils."""
@@ -121,7 +219,8 @@ Votre mission est d'explorer intelligemment les données BigQuery pour répondre
 PROCESSUS DE RECHERCHE AUTONOME À SUIVRE SYSTÉMATIQUEMENT:
 
 1. EXPLORATION DES DATASETS
-   - Commencez TOUJOURS par lister tous les datasets disponibles avec list_datasets()
+   - Commencez TOUJOURS par list_all_tables() qui liste d'un coup les tables de tous les datasets
+     de tous les projets configurés (ou list_datasets(project_id) pour un seul projet)
    - Identifiez les datasets qui pourraient être pertinents selon la question
 
 2. EXPLORATION DES TABLES
@@ -146,6 +245,10 @@ RÈGLES IMPORTANTES:
 - Si vous ne trouvez pas de table correspondante après exploration complète, informez l'utilisateur
 - Privilégiez la précision sur la rapidité
 - Utilisez des requêtes SQL optimisées pour BigQuery (avec LIMIT si approprié)
+- Filtrez TOUJOURS les tables partitionnées sur leur colonne de partition (indiquée dans le schéma)
+- Pour une requête exploratoire, appelez execute_sql_query(sql_query, preview=True)
+- Lorsque plusieurs appels sont indépendants (ex: schémas de plusieurs tables), émettez-les
+  dans la même réponse: ils sont exécutés en parallèle
 
 EXEMPLE DE RAISONNEMENT:
 Question: "donne moi le nombre de vues par vidéo"
@@ -157,13 +260,22 @@ Question: "donne moi le nombre de vues par vidéo"
 6. Je construis: SELECT video_id, video_title, views FROM project.youtube_analytics.video_stats
 7. J'exécute la requête
 
-Commencez toujours votre exploration maintenant."""),
+Si un CONTEXTE DE SESSION figure ci-dessous, les tables et schémas qu'il contient ont déjà été
+explorés lors des questions précédentes: réutilisez-les directement (étape 4) sans rappeler les
+outils d'exploration, et n'explorez que ce qui manque.
+
+Commencez toujours votre exploration maintenant.
+
+{session_context}"""),
             ("human", "{input}"),
             ("placeholder", "{agent_scratchpad}"),
         ])
 
         agent = create_tool_calling_agent(self.llm, self.tools, prompt)
-        return AgentExecutor(agent=agent, tools=self.tools, verbose=True, max_iterations=15)
+        return AgentExecutor(
+            agent=agent, tools=self.tools, verbose=True, max_iterations=15,
+            return_intermediate_steps=True,
+        )
 
     def query(self, natural_language_query: str) -> pd.DataFrame:
         """
@@ -176,10 +288,27 @@ Commencez toujours votre exploration maintenant."""),
             Un DataFrame pandas contenant les résultats de la requête.
         """
         self.last_query_result = None
+        self._query_results = {}
 
         try:
             # L'agent va explorer BigQuery, trouver la bonne table, et exécuter la requête
-            result = self.agent.invoke({"input": natural_language_query})
+            self.session.current_question = natural_language_query
+            session_context = self.session.build_context(natural_language_query)
+            inputs = {
+                "input": natural_language_query,
+                "session_context": (
+                    f"CONTEXTE DE SESSION:\n{session_context}" if session_context else ""
+                ),
+            }
+
+            timer = ToolTurnTimer()
+            config = {"callbacks": [timer]}
+            if self.concurrent_tools:
+                result = self._ainvoke_blocking(inputs, config)
+            else:
+                result = self.agent.invoke(inputs, config=config)
+            timer.flush()
+            self.last_query_result = self._last_emitted_result(result.get("intermediate_steps", []))
 
             # Si nous avons des résultats stockés, les retourner
             if hasattr(self, 'last_query_result') and self.last_query_result is not None:
@@ -191,3 +320,38 @@ Commencez toujours votre exploration maintenant."""),
         except Exception as e:
             print(f"Erreur lors de l'exécution de la requête: {e}")
             return pd.DataFrame({"error": [str(e)]})
+
+    def _last_emitted_result(self, intermediate_steps):
+        """
+        Retourne le résultat du dernier appel à `execute_sql_query` émis par le LLM, ou None.
+
+        Les étapes intermédiaires suivent l'ordre d'émission des appels, indépendamment
+        de l'ordre dans lequel les requêtes exécutées en parallèle se sont terminées.
+        """
+        for action, _ in reversed(intermediate_steps):
+            if action.tool != "execute_sql_query":
+                continue
+            tool_input = action.tool_input
+            sql_query = tool_input.get("sql_query") if isinstance(tool_input, dict) else tool_input
+            if sql_query in self._query_results:
+                return self._query_results[sql_query]
+        return None
+
+    def _ainvoke_blocking(self, inputs, config):
+        """
+        Exécute `ainvoke` de l'agent et attend son résultat depuis du code synchrone.
+
+        Si une boucle d'événements tourne déjà dans ce thread (Jupyter, hôte asynchrone),
+        `asyncio.run` y est interdit: l'agent tourne alors dans une boucle dédiée d'un autre thread.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.agent.ainvoke(inputs, config=config))
+
+        with ThreadPoolExecutor(max_workers=1) as runner:
+            return runner.submit(asyncio.run, self.agent.ainvoke(inputs, config=config)).result()
+
+    def reset_session(self):
+        """Oublie le contexte d'exploration accumulé (nouvelle conversation)."""
+        self.session.clear()
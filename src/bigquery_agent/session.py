@@ -0,0 +1,111 @@
+"""
+Mémoire de session de l'agent BigQuery.
+
+La session conserve ce que l'agent a déjà découvert (tables, schémas, requêtes SQL
+précédentes) afin de l'injecter sous forme compacte dans le prompt des questions
+suivantes, dans la limite d'un budget de tokens. Les questions de suivi évitent
+ainsi de refaire toute l'exploration datasets → tables → schémas.
+"""
+
+import os
+import re
+
+from ..sql_analyzer import describe_table_layout
+
+# Budget de tokens alloué au contexte de session injecté dans le prompt
+SESSION_TOKEN_BUDGET = int(os.getenv("BIGQUERY_AGENT_SESSION_TOKENS", "2000"))
+
+# Nombre de requêtes SQL précédentes conservées dans la session
+SESSION_MAX_QUERIES = 5
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def estimate_tokens(text):
+    """Estimation grossière du nombre de tokens d'un texte (~4 caractères par token)."""
+    return len(text) // 4 + 1
+
+
+def _words(text):
+    # Les identifiants snake_case sont découpés pour être comparés aux mots de la question
+    return set(_WORD_RE.findall(text.lower().replace("_", " ")))
+
+
+class AgentSession:
+    """Contexte d'exploration accumulé au fil des questions d'une conversation."""
+
+    def __init__(self, token_budget=SESSION_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self.current_question = None
+        self.tables = {}
+        self.schemas = {}
+        self.queries = []
+
+    def record_tables(self, dataset_ref, table_ids):
+        """Mémorise les tables d'un dataset (`project.dataset`)."""
+        self.tables[dataset_ref] = list(table_ids)
+
+    def record_schema(self, full_table_id, table):
+        """Mémorise le schéma d'une table sous forme compacte."""
+        columns = ", ".join(f"{field.name} {field.field_type}" for field in table.schema)
+        layout = describe_table_layout(table)
+        suffix = f" [{'; '.join(layout)}]" if layout else ""
+        self.schemas[full_table_id] = f"{full_table_id}{suffix}: {columns}"
+
+    def record_query(self, sql_query):
+        """Mémorise une requête SQL exécutée avec succès pour la question en cours."""
+        self.queries.append((self.current_question, sql_query.strip()))
+        del self.queries[:-SESSION_MAX_QUERIES]
+
+    def clear(self):
+        self.current_question = None
+        self.tables.clear()
+        self.schemas.clear()
+        self.queries.clear()
+
+    def build_context(self, question):
+        """
+        Construit le contexte de session à injecter dans le prompt.
+
+        Les schémas les plus proches de la question (mots communs avec les noms de
+        tables et de colonnes) sont prioritaires, suivis des requêtes SQL précédentes
+        puis de la liste des tables connues, jusqu'à épuisement du budget de tokens.
+
+        Returns:
+            Le contexte sous forme de texte, ou une chaîne vide si la session est vide.
+        """
+        question_words = _words(question)
+        ranked_schemas = sorted(
+            self.schemas.values(),
+            key=lambda schema: len(question_words & _words(schema)),
+            reverse=True,
+        )
+
+        sections = [
+            ("Schémas déjà récupérés:", [f"- {schema}" for schema in ranked_schemas]),
+            ("Requêtes SQL précédentes:", [
+                f"- Q: {previous_question}\n  SQL: {' '.join(sql.split())}"
+                for previous_question, sql in reversed(self.queries)
+            ]),
+            ("Tables déjà listées:", [
+                f"- {dataset_ref}: {', '.join(table_ids)}"
+                for dataset_ref, table_ids in self.tables.items()
+            ]),
+        ]
+
+        remaining = self.token_budget
+        lines = []
+        for title, entries in sections:
+            kept = []
+            for entry in entries:
+                cost = estimate_tokens(entry)
+                if cost > remaining:
+                    # Une entrée trop longue ne doit pas masquer les suivantes, plus courtes
+                    continue
+                kept.append(entry)
+                remaining -= cost
+            if kept:
+                lines.append(title)
+                lines.extend(kept)
+
+        return "\n".join(lines)
@@ -0,0 +1,56 @@
+"""
+Mesure du temps d'exécution des outils par tour de l'agent.
+
+Un tour correspond aux appels d'outils émis par le LLM en une seule réponse ;
+ils sont regroupés entre deux appels au LLM. Pour chaque tour, le temps réel
+(wall-clock) est comparé à la somme des durées des outils, qui correspond au
+temps qu'aurait pris une exécution séquentielle.
+"""
+
+import time
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+class ToolTurnTimer(BaseCallbackHandler):
+    """Callback LangChain qui affiche le temps gagné par l'exécution concurrente des outils."""
+
+    # Exécuter le callback dans la boucle d'événements pour des mesures précises
+    run_inline = True
+
+    def __init__(self):
+        self.turn = 0
+        self._starts = {}
+        self._calls = []
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._starts[run_id] = time.perf_counter()
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._record(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._record(run_id)
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.flush()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.flush()
+
+    def _record(self, run_id):
+        start = self._starts.pop(run_id, None)
+        if start is not None:
+            self._calls.append((start, time.perf_counter()))
+
+    def flush(self):
+        """Affiche le bilan du tour en cours et prépare le suivant."""
+        if not self._calls:
+            return
+        self.turn += 1
+        wall_clock = max(end for _, end in self._calls) - min(start for start, _ in self._calls)
+        sequential = sum(end - start for start, end in self._calls)
+        print(
+            f"⏱️ Tour {self.turn}: {len(self._calls)} outil(s) en {wall_clock:.2f}s "
+            f"(séquentiel: {sequential:.2f}s, gain: {sequential - wall_clock:.2f}s)"
+        )
+        self._calls = []
@@ -1,18 +1,22 @@
-import os
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import plotly.express as px
 from dotenv import load_dotenv
 from ..llm_config import get_llm, get_provider_info
+from .codegen import extract_code_block, stream_code, strip_fences
+from .preparation import MAX_PLOT_ROWS, prepare_dataframe, sample_step
 
 load_dotenv()
 
+
 class DashboardAgent:
     def __init__(self):
         # Configurer le modèle LLM dynamiquement selon la configuration
         print(f"🤖 Utilisation du modèle: {get_provider_info()}")
         self.llm = get_llm(temperature=0.3)
 
-    def create_visualization(self, df: pd.DataFrame, description: str):
+    def create_visualization(self, df: pd.DataFrame, description: str, stream: bool = True,
+                             max_rows: int = MAX_PLOT_ROWS):
         """
         Génère et affiche une visualisation de données en utilisant Plotly,
         basée sur une description en langage naturel.
@@ -20,6 +24,10 @@ class DashboardAgent:
         Args:
             df (pd.DataFrame): Le DataFrame contenant les données à visualiser.
             description (str): Une description en langage naturel du graphique souhaité.
+            stream (bool): Si True, affiche la réponse du LLM au fil de l'eau et exécute le
+                code dès que le bloc de code est complet, pendant que les données sont préparées.
+            max_rows (int): Nombre maximal de lignes tracées (0 : toutes). Au-delà, une ligne
+                sur N est conservée et le prompt l'indique, avec le nombre de lignes d'origine.
         """
         if df.empty:
             print("Le DataFrame est vide. Impossible de créer une visualisation.")
@@ -29,6 +37,15 @@ class DashboardAgent:
         data_preview = df.head().to_string()
         column_names = ", ".join(df.columns)
 
+        step = sample_step(len(df), max_rows)
+        sampling_note = ""
+        if step > 1:
+            sampling_note = (
+                f"Attention : `df` ne contient qu'une ligne sur {step} des {len(df)} lignes du résultat "
+                f"(environ {-(-len(df) // step)} lignes, dans l'ordre d'origine). Tracez les valeurs telles "
+                "quelles (courbe, nuage de points) ; n'en tirez pas de totaux, comptages ou histogrammes."
+            )
+
         prompt = f"""
         En tant qu'expert en visualisation de données, votre tâche est de générer du code Python pour créer un graphique avec Plotly Express.
         Le code doit utiliser un DataFrame pandas nommé `df`.
@@ -37,6 +54,7 @@ class DashboardAgent:
         {data_preview}
 
         Les colonnes disponibles sont : {column_names}.
+        {sampling_note}
 
         Description de la visualisation souhaitée : "{description}"
 
@@ -45,20 +63,32 @@ class DashboardAgent:
         2. Utilisez le DataFrame `df` qui sera disponible dans le scope d'exécution.
         3. Créez une figure Plotly Express et assignez-la à une variable nommée `fig`.
         4. Appelez `fig.show()` pour afficher le graphique.
-        5. Ne générez QUE le code Python. N'ajoutez pas d'explications, de commentaires ou de formatage markdown.
+        5. Répondez avec exactement un bloc de code markdown ```python ... ``` contenant tout le code.
+           N'ajoutez pas d'explications ni de commentaires, ni avant ni après le bloc.
         6. Le code doit être prêt à être exécuté tel quel.
         """
 
         try:
-            response = self.llm.invoke(prompt)
-            generated_code = response.content.strip().replace("```python", "").replace("```", "").strip()
+            # Préparer les données en parallèle de la génération du code par le LLM
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                prepared_df = executor.submit(prepare_dataframe, df, max_rows)
+                if stream:
+                    generated_code = self._stream_code(prompt)
+                else:
+                    response = self.llm.invoke(prompt)
+                    text = getattr(response, "content", response)
+                    generated_code = extract_code_block(text) or strip_fences(text)
 
-            print("\nCode de visualisation généré :")
-            print(generated_code)
+                    print("\nCode de visualisation généré :")
+                    print(generated_code)
+                plot_df = prepared_df.result()
+
+            if len(plot_df) < len(df):
+                print(f"\nDonnées échantillonnées: {len(plot_df)} lignes sur {len(df)}.")
 
             # Préparer l'environnement d'exécution pour le code généré
             exec_scope = {
-                "df": df,
+                "df": plot_df,
                 "px": px,
                 "pd": pd
             }
@@ -70,3 +100,8 @@ class DashboardAgent:
 
         except Exception as e:
             print(f"Une erreur est survenue lors de la création de la visualisation : {e}")
+
+    def _stream_code(self, prompt):
+        """Affiche la réponse du LLM au fil de l'eau et retourne le code dès que le bloc est complet."""
+        print("\nCode de visualisation généré :")
+        return stream_code(self.llm, prompt)
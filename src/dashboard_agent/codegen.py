@@ -0,0 +1,44 @@
+"""
+Extraction du code Python généré par le LLM de l'agent Dashboard.
+"""
+
+import re
+
+_CODE_BLOCK_RE = re.compile(r"```(?:python|py)?[ \t]*\n(.*?)```", re.DOTALL)
+
+
+def extract_code_block(text):
+    """Retourne le contenu du premier bloc de code markdown complet, ou None s'il n'est pas terminé."""
+    match = _CODE_BLOCK_RE.search(text)
+    return match.group(1).strip() if match else None
+
+
+def strip_fences(text):
+    """Enlève les marqueurs markdown d'un code généré."""
+    return text.strip().replace("```python", "").replace("```", "").strip()
+
+
+def stream_code(llm, prompt):
+    """
+    Consomme la réponse du LLM au fil de l'eau et retourne le code généré.
+
+    Les tokens sont affichés dès leur arrivée. Dès qu'un bloc de code markdown
+    est fermé, la lecture s'arrête sans attendre la fin de la réponse.
+    """
+    text = ""
+    stream = llm.stream(prompt)
+    try:
+        for chunk in stream:
+            token = getattr(chunk, "content", chunk)
+            if not isinstance(token, str):
+                continue
+            print(token, end="", flush=True)
+            text += token
+            code = extract_code_block(text)
+            if code is not None:
+                return code
+        return strip_fences(text)
+    finally:
+        # Fermer le flux tout de suite pour interrompre la génération en cas d'arrêt anticipé
+        stream.close()
+        print()
@@ -0,0 +1,46 @@
+"""
+Préparation des résultats BigQuery avant leur visualisation avec Plotly.
+"""
+
+import os
+from decimal import Decimal
+
+import pandas as pd
+
+# Nombre maximal de lignes transmises à Plotly ; 0 désactive l'échantillonnage.
+# Un échantillon fausse les totaux (barres, histogrammes) : à réserver aux courbes et nuages de points.
+MAX_PLOT_ROWS = int(os.getenv("DASHBOARD_MAX_PLOT_ROWS", "0"))
+
+
+def sample_step(row_count, max_rows=MAX_PLOT_ROWS):
+    """Pas de l'échantillonnage régulier à appliquer (1 si aucun échantillonnage)."""
+    if not max_rows or row_count <= max_rows:
+        return 1
+    return -(-row_count // max_rows)
+
+
+def prepare_dataframe(df, max_rows=MAX_PLOT_ROWS):
+    """
+    Prépare un DataFrame pour la visualisation.
+
+    Les colonnes `dbdate`/`dbtime` et les décimaux renvoyés par BigQuery sont convertis
+    en types pandas natifs. Si `max_rows` est défini et dépassé, une ligne sur N est
+    conservée, dans l'ordre du résultat (l'allure d'un axe x ordonné est préservée).
+    """
+    df = df.copy()
+    for column in df.columns:
+        dtype_name = str(df[column].dtype)
+        if dtype_name == "dbdate":
+            df[column] = df[column].astype("datetime64[ns]")
+        elif dtype_name == "dbtime":
+            df[column] = df[column].astype(str)
+        elif dtype_name == "object":
+            # Les colonnes NUMERIC/BIGNUMERIC arrivent sous forme d'objets Decimal
+            values = df[column].dropna()
+            if not values.empty and isinstance(values.iloc[0], Decimal):
+                df[column] = pd.to_numeric(df[column], errors="coerce")
+
+    step = sample_step(len(df), max_rows)
+    if step > 1:
+        df = df.iloc[::step]
+    return df
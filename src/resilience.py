@@ -0,0 +1,263 @@
+"""
+Résilience des appels de métadonnées BigQuery (`list_datasets`, `list_tables`, `get_table`).
+
+Sous charge, ces appels renvoient parfois des erreurs de quota ou des réponses très
+lentes. Cette couche applique, par endpoint:
+- des reprises avec backoff exponentiel et jitter sur les erreurs transitoires ;
+- une requête de couverture (hedging) lorsque l'appel dépasse un percentile de latence ;
+- un disjoncteur qui, une fois ouvert, sert les métadonnées en cache même périmées
+  au lieu d'échouer.
+
+L'horloge, l'attente et l'aléa sont injectables afin de pouvoir tester la couche
+avec un client factice qui injecte des pannes.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("BIGQUERY_RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.getenv("BIGQUERY_RETRY_BASE_DELAY", "0.2"))
+RETRY_MAX_DELAY = float(os.getenv("BIGQUERY_RETRY_MAX_DELAY", "5"))
+
+# Percentile de latence au-delà duquel une requête de couverture est envoyée
+HEDGE_PERCENTILE = float(os.getenv("BIGQUERY_HEDGE_PERCENTILE", "0.95"))
+# Nombre minimal de mesures avant d'activer le hedging sur un endpoint
+HEDGE_MIN_SAMPLES = 20
+# Délai minimal avant une requête de couverture, pour ne pas doubler les appels rapides
+HEDGE_MIN_DELAY = 0.05
+
+# Timeout (secondes) d'une tentative: les reprises internes de la bibliothèque sont désactivées
+# (`retry=None`) pour que cette couche contrôle seule les reprises et le hedging
+METADATA_CALL_TIMEOUT = float(os.getenv("BIGQUERY_METADATA_TIMEOUT", "30"))
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BIGQUERY_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BIGQUERY_BREAKER_RESET_SECONDS", "30"))
+
+# Codes HTTP des erreurs transitoires (quota, indisponibilité, timeout)
+_RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+_RETRYABLE_REASONS = {"rateLimitExceeded", "backendError", "internalError", "badGateway"}
+
+
+class CircuitOpenError(Exception):
+    """Levée lorsque le disjoncteur d'un endpoint est ouvert et qu'aucun cache n'est disponible."""
+
+
+def is_retryable(error):
+    """
+    Indique si une erreur est transitoire et mérite une nouvelle tentative.
+
+    Les exceptions `google.api_core` exposent un code HTTP (`code`) et les raisons de
+    l'erreur dans `errors[i]["reason"]` ; BigQuery signale notamment les dépassements de
+    quota par un 403 dont la raison est `rateLimitExceeded`.
+    """
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    if getattr(error, "code", None) in _RETRYABLE_CODES:
+        return True
+    reasons = {
+        detail.get("reason") for detail in getattr(error, "errors", None) or []
+        if isinstance(detail, dict)
+    }
+    return bool(reasons & _RETRYABLE_REASONS)
+
+
+class LatencyTracker:
+    """Fenêtre glissante des latences observées sur un endpoint."""
+
+    def __init__(self, window=100):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        with self._lock:
+            self._samples.append(latency)
+
+    def percentile(self, percentile, min_samples=HEDGE_MIN_SAMPLES):
+        """Retourne la latence au percentile demandé, ou None s'il y a trop peu de mesures."""
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(percentile * len(ordered)))]
+
+
+class CircuitBreaker:
+    """Disjoncteur fermé / ouvert / semi-ouvert sur les échecs consécutifs d'un endpoint."""
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds=BREAKER_RESET_SECONDS, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def allow_request(self):
+        """Indique si un appel peut être tenté (une seule tentative d'essai en semi-ouvert)."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_progress:
+                self._trial_in_progress = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_progress = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+
+
+class MetadataResilience:
+    """
+    Exécute les appels de métadonnées avec reprises, hedging et disjoncteur par endpoint.
+
+    Args:
+        max_attempts: Nombre maximal de tentatives par appel.
+        base_delay: Délai initial du backoff exponentiel (secondes).
+        max_delay: Délai maximal entre deux tentatives (secondes).
+        hedge_percentile: Percentile de latence déclenchant une requête de couverture
+            (None pour désactiver le hedging).
+        failure_threshold: Échecs consécutifs avant ouverture du disjoncteur.
+        reset_seconds: Durée d'ouverture du disjoncteur avant une tentative d'essai.
+        clock, sleep, rng: Horloge, attente et générateur aléatoire (injectables pour les tests).
+    """
+
+    def __init__(self, max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY,
+                 max_delay=RETRY_MAX_DELAY, hedge_percentile=HEDGE_PERCENTILE,
+                 failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS,
+                 clock=time.monotonic, sleep=time.sleep, rng=random.random, max_workers=16):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_percentile = hedge_percentile
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng
+        self.breakers = {}
+        self.latencies = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _endpoint_state(self, endpoint):
+        with self._lock:
+            if endpoint not in self.breakers:
+                self.breakers[endpoint] = CircuitBreaker(
+                    self.failure_threshold, self.reset_seconds, self.clock
+                )
+                self.latencies[endpoint] = LatencyTracker()
+            return self.breakers[endpoint], self.latencies[endpoint]
+
+    def backoff_delay(self, attempt):
+        """Délai avant la tentative suivante: backoff exponentiel avec jitter complet."""
+        return self.rng() * min(self.max_delay, self.base_delay * 2 ** attempt)
+
+    def call(self, endpoint, func, *args, fallback=None, **kwargs):
+        """
+        Appelle `func(*args, **kwargs)` de manière résiliente.
+
+        Args:
+            endpoint: Nom de l'endpoint (ex: "get_table"), qui porte le disjoncteur
+                et les statistiques de latence.
+            func: Fonction bloquante à appeler. Elle doit matérialiser son résultat
+                (pas d'itérateur paresseux) pour que les reprises couvrent la pagination.
+            fallback: Fonction sans argument retournant la valeur en cache (même périmée),
+                ou None si aucune n'est disponible.
+
+        Returns:
+            Le résultat de l'appel, ou la valeur de `fallback` si le disjoncteur est
+            ouvert ou si les erreurs transitoires persistent.
+        """
+        breaker, latencies = self._endpoint_state(endpoint)
+
+        if not breaker.allow_request():
+            stale = fallback() if fallback is not None else None
+            if stale is not None:
+                logger.warning("Disjoncteur ouvert sur %s: métadonnées en cache servies.", endpoint)
+                return stale
+            raise CircuitOpenError(
+                f"Le service BigQuery ({endpoint}) est temporairement indisponible, réessayez plus tard."
+            )
+
+        for attempt in range(self.max_attempts):
+            try:
+                result = self._hedged_call(latencies, func, args, kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    # Erreur définitive (table inexistante, droits...): pas de reprise
+                    breaker.record_success()
+                    raise
+                if attempt + 1 < self.max_attempts:
+                    self.sleep(self.backoff_delay(attempt))
+                    continue
+
+                breaker.record_failure()
+                stale = fallback() if fallback is not None else None
+                if stale is not None:
+                    logger.warning("Échec de %s après %d tentatives: métadonnées en cache servies (%s).",
+                                   endpoint, self.max_attempts, e)
+                    return stale
+                raise
+            else:
+                breaker.record_success()
+                return result
+
+    def _hedged_call(self, latencies, func, args, kwargs):
+        """Exécute l'appel, en envoyant une requête de couverture s'il dépasse le seuil de latence."""
+
+        def timed_call():
+            start = self.clock()
+            result = func(*args, **kwargs)
+            latencies.record(self.clock() - start)
+            return result
+
+        threshold = (
+            latencies.percentile(self.hedge_percentile)
+            if self.hedge_percentile is not None else None
+        )
+        if threshold is None:
+            return timed_call()
+
+        primary = self._executor.submit(timed_call)
+        done, _ = wait([primary], timeout=max(threshold, HEDGE_MIN_DELAY))
+        if done:
+            return primary.result()
+
+        hedge = self._executor.submit(timed_call)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
@@ -0,0 +1,397 @@
+"""
+Analyse légère des requêtes SQL avant leur exécution sur BigQuery.
+
+Le SQL généré par un LLM contient souvent des `SELECT *` sur des tables larges,
+oublie les filtres de partition et n'a pas de `LIMIT` sur les requêtes exploratoires.
+Ce module vérifie les tables référencées à partir de métadonnées mises en cache
+(schéma, partitionnement, clustering), réécrit les requêtes d'aperçu et signale
+les scans de tables partitionnées sans filtre sur la colonne de partition.
+"""
+
+import os
+import re
+import time
+
+from .resilience import METADATA_CALL_TIMEOUT
+
+# Nombre maximal de lignes retournées par une requête d'aperçu
+PREVIEW_ROW_LIMIT = int(os.getenv("BIGQUERY_PREVIEW_LIMIT", "100"))
+
+# Nombre maximal de colonnes projetées lorsqu'un `SELECT *` est réécrit en aperçu
+PREVIEW_MAX_COLUMNS = int(os.getenv("BIGQUERY_PREVIEW_MAX_COLUMNS", "20"))
+
+# Refuser (au lieu d'avertir) les scans de tables partitionnées sans filtre de partition
+REJECT_UNPRUNED_SCANS = os.getenv("BIGQUERY_REJECT_UNPRUNED_SCANS", "false").lower() in (
+    "1", "true", "yes", "oui"
+)
+
+# Types de colonnes exclus de la projection d'un aperçu (volumineux et peu lisibles)
+_PREVIEW_EXCLUDED_TYPES = {"BYTES", "RECORD", "STRUCT", "GEOGRAPHY", "JSON"}
+
+# Éléments lexicaux dont le contenu ne doit pas être interprété comme du SQL:
+# commentaires, littéraux de chaîne (y compris triple quotes) et identifiants entre backticks
+_LEXICAL_RE = re.compile(
+    r"(?P<comment>--[^\n]*|#[^\n]*|/\*.*?\*/)"
+    r"|(?P<string>'''.*?'''|\"\"\".*?\"\"\"|'(?:\\.|[^'\\\n])*'|\"(?:\\.|[^\"\\\n])*\")"
+    r"|(?P<identifier>`(?:\\.|[^`\\])*`)",
+    re.DOTALL,
+)
+_TABLE_REF_RE = re.compile(
+    r"\b(?:FROM|JOIN)\s+(`[^`]+`|[A-Za-z0-9_\-]+(?:\.[A-Za-z0-9_\-]+){1,2})"
+    r"(?:\s+(?:AS\s+)?(?!(?:WHERE|JOIN|INNER|LEFT|RIGHT|FULL|CROSS|ON|USING|GROUP|ORDER|LIMIT"
+    r"|HAVING|QUALIFY|WINDOW|UNION|INTERSECT|EXCEPT|FOR|TABLESAMPLE|PIVOT|UNPIVOT)\b)"
+    r"([A-Za-z_][A-Za-z0-9_]*))?",
+    re.IGNORECASE,
+)
+_TRAILING_LIMIT_RE = re.compile(
+    r"\bLIMIT\s+(\d+)(\s+OFFSET\s+\d+)?\s*$", re.IGNORECASE
+)
+_SIMPLE_SELECT_STAR_RE = re.compile(
+    r"^\s*SELECT\s+(\*)\s+FROM\s+(?:`[^`]+`|[A-Za-z0-9_\-]+(?:\.[A-Za-z0-9_\-]+){1,2})(?=\s|$)",
+    re.IGNORECASE,
+)
+_WHERE_RE = re.compile(r"\bWHERE\b", re.IGNORECASE)
+# Fin d'une clause WHERE au même niveau de parenthèses
+_WHERE_BOUNDARY_RE = re.compile(
+    r"[()]|\b(?:GROUP\s+BY|ORDER\s+BY|HAVING|QUALIFY|WINDOW|LIMIT|UNION|INTERSECT|EXCEPT)\b",
+    re.IGNORECASE,
+)
+_COMPARISON = r"(?:[<>!]?=|<>|<|>)"
+_PREVIEWABLE_RE = re.compile(r"^[\s(]*(?:SELECT|WITH)\b", re.IGNORECASE)
+
+
+class TableMetadataCache:
+    """Cache des métadonnées de tables BigQuery (schéma, partitionnement, clustering)."""
+
+    def __init__(self, ttl_seconds=300, resilience=None):
+        self.ttl_seconds = ttl_seconds
+        # Instance optionnelle de `MetadataResilience` pour les appels à `get_table`
+        self.resilience = resilience
+        self._entries = {}
+
+    def get_table(self, client, full_table_id):
+        """
+        Retourne l'objet `Table` BigQuery, depuis le cache s'il est encore frais.
+
+        Args:
+            client: Client BigQuery utilisé en cas d'absence dans le cache.
+            full_table_id: Identifiant complet `project.dataset.table`.
+        """
+        entry = self._entries.get(full_table_id)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl_seconds:
+            return entry[1]
+
+        if self.resilience is None:
+            table = client.get_table(full_table_id)
+        else:
+            table = self.resilience.call(
+                "get_table", client.get_table, full_table_id,
+                retry=None, timeout=METADATA_CALL_TIMEOUT,
+                fallback=lambda: self.get_stale(full_table_id),
+            )
+            if entry is not None and table is entry[1]:
+                # Métadonnées périmées servies par le disjoncteur: ne pas rafraîchir l'entrée
+                return table
+        self._entries[full_table_id] = (time.monotonic(), table)
+        return table
+
+    def get_stale(self, full_table_id):
+        """Retourne l'objet `Table` en cache quel que soit son âge, ou None."""
+        entry = self._entries.get(full_table_id)
+        return entry[1] if entry is not None else None
+
+    def invalidate(self, full_table_id=None):
+        """Supprime une entrée du cache, ou tout le cache si aucun identifiant n'est fourni."""
+        if full_table_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(full_table_id, None)
+
+
+class SqlAnalysis:
+    """Résultat de l'analyse d'une requête SQL."""
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.tables = []
+        self.warnings = []
+        self.rewrites = []
+        self.rejection_reason = None
+
+    @property
+    def rejected(self):
+        return self.rejection_reason is not None
+
+    def format_notes(self):
+        """Formate les avertissements et réécritures pour les inclure dans une réponse d'outil."""
+        lines = [f"⚠️ {warning}" for warning in self.warnings]
+        lines += [f"ℹ️ {rewrite}" for rewrite in self.rewrites]
+        return "\n".join(lines)
+
+
+def _mask_lexical(match):
+    if match.group("comment"):
+        return " " * len(match.group())
+    if match.group("string"):
+        literal = match.group()
+        quote = 3 if literal[:3] in ("'''", '"""') else 1
+        return literal[:quote] + " " * (len(literal) - 2 * quote) + literal[-quote:]
+    return match.group()
+
+
+def analysis_view(sql_query):
+    """
+    Retourne une vue de la requête destinée à l'analyse, de même longueur que l'originale.
+
+    Les commentaires et le contenu des littéraux de chaîne sont remplacés par des espaces:
+    les positions trouvées dans la vue s'appliquent donc telles quelles au texte d'origine.
+    """
+    return _LEXICAL_RE.sub(_mask_lexical, sql_query)
+
+
+def _statement_end(view):
+    """Position de fin de l'instruction, hors point-virgule et commentaires finaux."""
+    stripped = view.rstrip()
+    if stripped.endswith(";"):
+        stripped = stripped[:-1].rstrip()
+    return len(stripped)
+
+
+def resolve_table_id(table_ref, default_project):
+    """Convertit une référence de table (`dataset.table` ou `project.dataset.table`) en ID complet."""
+    parts = table_ref.strip("`").split(".")
+    if len(parts) == 2:
+        parts.insert(0, default_project)
+    return ".".join(parts) if len(parts) == 3 else None
+
+
+def find_table_references(sql_query, default_project):
+    """Retourne les identifiants complets des tables lues par la requête, sans doublons."""
+    table_ids = []
+    for match in _TABLE_REF_RE.finditer(sql_query):
+        table_ref = match.group(1)
+        if "INFORMATION_SCHEMA" in table_ref.upper():
+            continue
+        full_table_id = resolve_table_id(table_ref, default_project)
+        if full_table_id and full_table_id not in table_ids:
+            table_ids.append(full_table_id)
+    return table_ids
+
+
+def get_partition_columns(table):
+    """
+    Retourne les colonnes permettant l'élagage des partitions d'une table,
+    ou une liste vide si la table n'est pas partitionnée.
+    """
+    if table.time_partitioning is not None:
+        if table.time_partitioning.field:
+            return [table.time_partitioning.field]
+        # Partitionnement par date d'ingestion
+        return ["_PARTITIONTIME", "_PARTITIONDATE"]
+    if table.range_partitioning is not None and table.range_partitioning.field:
+        return [table.range_partitioning.field]
+    return []
+
+
+def find_table_qualifiers(sql_query, default_project):
+    """
+    Associe à chaque table lue par la requête les qualificatifs utilisables pour
+    ses colonnes: son alias, ou à défaut son nom court (`t` pour `ds.t`).
+    """
+    qualifiers = {}
+    for match in _TABLE_REF_RE.finditer(sql_query):
+        if "INFORMATION_SCHEMA" in match.group(1).upper():
+            continue
+        full_table_id = resolve_table_id(match.group(1), default_project)
+        if full_table_id:
+            qualifier = match.group(2) or full_table_id.rsplit(".", 1)[-1]
+            qualifiers.setdefault(full_table_id, set()).add(qualifier.lower())
+    return qualifiers
+
+
+def _where_clauses(sql_query):
+    """Retourne le texte de chaque clause WHERE, borné à la clause suivante ou à la parenthèse fermante."""
+    clauses = []
+    for where in _WHERE_RE.finditer(sql_query):
+        depth = 0
+        end = len(sql_query)
+        for token in _WHERE_BOUNDARY_RE.finditer(sql_query, where.end()):
+            if token.group() == "(":
+                depth += 1
+            elif token.group() == ")":
+                depth -= 1
+                if depth < 0:
+                    end = token.start()
+                    break
+            elif depth == 0:
+                end = token.start()
+                break
+        clauses.append(sql_query[where.end():end])
+    return clauses
+
+
+def _has_filter_on(sql_query, columns, qualifiers=None, allow_unqualified=True):
+    """
+    Indique si une clause WHERE de la requête compare l'une des colonnes
+    (opérateur de comparaison, BETWEEN ou IN ; `IS NOT NULL` n'élague rien).
+
+    Args:
+        sql_query: Vue d'analyse de la requête.
+        columns: Colonnes de partitionnement de la table.
+        qualifiers: Alias ou noms acceptés devant la colonne ; None accepte tout qualificatif.
+        allow_unqualified: Si False, la colonne doit être qualifiée (nom ambigu entre plusieurs tables).
+    """
+    for clause in _where_clauses(sql_query):
+        for column in columns:
+            # Colonne éventuellement qualifiée et enveloppée dans un appel de fonction (DATE(...))
+            reference = rf"(?<![\w.`])(?:(?P<qualifier>\w+)\.)?`?{re.escape(column)}\b`?"
+            predicates = (
+                rf"{reference}(?:\s*(?:,\s*\w+\s*)?\))*\s*(?:{_COMPARISON}|\bBETWEEN\b|\bIN\b)",
+                rf"{_COMPARISON}\s*(?:\w+\s*\(\s*)*{reference}",
+            )
+            for predicate in predicates:
+                for match in re.finditer(predicate, clause, re.IGNORECASE):
+                    qualifier = match.group("qualifier")
+                    if qualifier is None:
+                        if allow_unqualified:
+                            return True
+                    elif qualifiers is None or qualifier.lower() in qualifiers:
+                        return True
+    return False
+
+
+def _preview_limit_edit(view, analysis, row_limit):
+    """Retourne la modification `(début, fin, texte)` qui borne l'aperçu par un LIMIT, ou None."""
+    match = _TRAILING_LIMIT_RE.search(view)
+    if match is None:
+        analysis.rewrites.append(f"LIMIT {row_limit} ajouté pour l'aperçu.")
+        return len(view), len(view), f"\nLIMIT {row_limit}"
+    if int(match.group(1)) > row_limit:
+        analysis.rewrites.append(f"LIMIT réduit à {row_limit} pour l'aperçu.")
+        return match.start(1), match.end(1), str(row_limit)
+    return None
+
+
+def _preview_projection_edit(view, table, analysis, max_columns):
+    """Retourne la modification remplaçant un `SELECT *` simple par les colonnes utiles, ou None."""
+    if re.search(r"\bJOIN\b|\bUNION\b", view, re.IGNORECASE):
+        return None
+    match = _SIMPLE_SELECT_STAR_RE.match(view)
+    if match is None:
+        return None
+
+    columns = [
+        field.name for field in table.schema
+        if field.field_type not in _PREVIEW_EXCLUDED_TYPES and field.mode != "REPEATED"
+    ]
+    if not columns or (len(columns) == len(table.schema) and len(columns) <= max_columns):
+        return None
+
+    selected = columns[:max_columns]
+    analysis.rewrites.append(
+        f"SELECT * remplacé par {len(selected)} colonne(s) sur {len(table.schema)} pour l'aperçu."
+    )
+    projection = ", ".join(f"`{name}`" for name in selected)
+    return match.start(1), match.end(1), projection
+
+
+def analyze_sql(sql_query, client, cache, preview=False,
+                row_limit=PREVIEW_ROW_LIMIT, max_columns=PREVIEW_MAX_COLUMNS,
+                reject_unpruned=REJECT_UNPRUNED_SCANS):
+    """
+    Analyse une requête SQL avant exécution.
+
+    Args:
+        sql_query: La requête SQL à analyser.
+        client: Client BigQuery (pour le projet par défaut et les métadonnées).
+        cache: Instance de `TableMetadataCache`.
+        preview: Si True, ajoute un LIMIT et restreint les colonnes d'un `SELECT *`.
+        row_limit: Nombre maximal de lignes d'un aperçu.
+        max_columns: Nombre maximal de colonnes projetées d'un aperçu.
+        reject_unpruned: Si True, refuse les scans de tables partitionnées sans filtre.
+
+    Returns:
+        Un `SqlAnalysis` contenant la requête (éventuellement réécrite),
+        les avertissements et l'éventuelle raison du refus.
+    """
+    # L'analyse porte sur une vue sans commentaires ni contenu de chaînes ; la requête
+    # d'origine est exécutée telle quelle, ou modifiée aux positions trouvées dans la vue.
+    analysis = SqlAnalysis(sql_query)
+    view = analysis_view(sql_query)
+    end = _statement_end(view)
+    view, sql_query = view[:end], sql_query[:end]
+
+    tables = {}
+    for full_table_id in find_table_references(view, client.project):
+        try:
+            tables[full_table_id] = cache.get_table(client, full_table_id)
+        except Exception:
+            # Table joker, vue inaccessible, etc. : l'analyse reste best-effort
+            continue
+    analysis.tables = list(tables)
+
+    table_qualifiers = find_table_qualifiers(view, client.project)
+    for full_table_id, table in tables.items():
+        partition_columns = get_partition_columns(table)
+        if not partition_columns:
+            continue
+        if len(table_qualifiers) > 1:
+            # Plusieurs tables: le filtre doit porter sur la colonne de cette table
+            other_columns = {
+                name.lower()
+                for other_id, other in tables.items() if other_id != full_table_id
+                for name in [field.name for field in other.schema] + get_partition_columns(other)
+            }
+            pruned = _has_filter_on(
+                view, partition_columns,
+                qualifiers=table_qualifiers.get(full_table_id, set()),
+                allow_unqualified=not other_columns & {c.lower() for c in partition_columns},
+            )
+        else:
+            pruned = _has_filter_on(view, partition_columns)
+        if pruned:
+            continue
+
+        message = (
+            f"La table '{full_table_id}' est partitionnée sur {partition_columns[0]} "
+            f"mais la requête ne filtre pas sur cette colonne: toutes les partitions seront lues."
+        )
+        if table.clustering_fields:
+            message += f" Clustering: {', '.join(table.clustering_fields)}."
+        if reject_unpruned or table.require_partition_filter:
+            analysis.rejection_reason = (
+                message + f" Ajoutez un filtre WHERE sur {partition_columns[0]}."
+            )
+            return analysis
+        analysis.warnings.append(message)
+
+    if preview and not _PREVIEWABLE_RE.match(view):
+        # CREATE TABLE AS, INSERT ... SELECT, DELETE, UPDATE: un LIMIT changerait leur effet
+        analysis.rewrites.append("Aperçu ignoré: seules les requêtes SELECT et WITH sont réécrites.")
+    elif preview:
+        edits = []
+        if len(tables) == 1:
+            edits.append(_preview_projection_edit(
+                view, next(iter(tables.values())), analysis, max_columns
+            ))
+        edits.append(_preview_limit_edit(view, analysis, row_limit))
+        # Appliquer de la fin vers le début pour conserver les positions des autres modifications
+        for start, stop, text in sorted((e for e in edits if e), reverse=True):
+            sql_query = sql_query[:start] + text + sql_query[stop:]
+        if analysis.rewrites:
+            analysis.sql = sql_query
+
+    return analysis
+
+
+def describe_table_layout(table):
+    """Retourne les lignes décrivant le partitionnement et le clustering d'une table."""
+    lines = []
+    if table.time_partitioning is not None:
+        field = table.time_partitioning.field or "_PARTITIONTIME"
+        lines.append(f"Partitionnement: {field} ({table.time_partitioning.type_})")
+    elif table.range_partitioning is not None:
+        lines.append(f"Partitionnement: {table.range_partitioning.field} (RANGE)")
+    if table.clustering_fields:
+        lines.append(f"Clustering: {', '.join(table.clustering_fields)}")
+    return lines
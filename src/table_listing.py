@@ -0,0 +1,241 @@
+"""
+Listing des tables BigQuery sur plusieurs projets et datasets en parallèle.
+
+Les appels `list_datasets` / `list_tables` sont répartis sur un pool de threads
+à concurrence bornée, les résultats par dataset sont mis en cache, et le tout
+est fusionné en un listing compact.
+"""
+
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .resilience import METADATA_CALL_TIMEOUT
+
+# Nombre maximal d'appels de listing simultanés
+LISTING_MAX_WORKERS = int(os.getenv("BIGQUERY_LISTING_MAX_WORKERS", "8"))
+
+# Taille des pages demandées à l'API BigQuery lors du listing des tables
+LISTING_PAGE_SIZE = int(os.getenv("BIGQUERY_LISTING_PAGE_SIZE", "1000"))
+
+# Nombre maximal d'entrées affichées par dataset dans le listing (familles de shards comprises)
+LISTING_MAX_TABLES_PER_DATASET = int(os.getenv("BIGQUERY_LISTING_MAX_TABLES_PER_DATASET", "50"))
+
+# Tables shardées par date: `events_20230101`, `events_20230102`...
+_SHARD_RE = re.compile(r"^(.*\D)(\d{8})$")
+
+
+def get_project_ids(default_project=None):
+    """
+    Retourne la liste des projets BigQuery configurés.
+
+    `GOOGLE_CLOUD_PROJECT_IDS` (liste séparée par des virgules) permet d'explorer
+    plusieurs projets ; à défaut, seul `GOOGLE_CLOUD_PROJECT_ID` est utilisé.
+    """
+    project_ids = [
+        project_id.strip()
+        for project_id in os.getenv("GOOGLE_CLOUD_PROJECT_IDS", "").split(",")
+        if project_id.strip()
+    ]
+    default_project = default_project or os.getenv("GOOGLE_CLOUD_PROJECT_ID")
+    if default_project and default_project not in project_ids:
+        project_ids.insert(0, default_project)
+    return project_ids
+
+
+class DatasetTablesCache:
+    """
+    Cache des listes de tables par dataset (`project.dataset`).
+
+    Les listes de datasets d'un projet y sont aussi conservées, sous la clé `("datasets", project)`.
+    """
+
+    def __init__(self, ttl_seconds=300, resilience=None):
+        self.ttl_seconds = ttl_seconds
+        # Instance optionnelle de `MetadataResilience` pour les appels de listing
+        self.resilience = resilience
+        self._entries = {}
+
+    def get(self, dataset_ref):
+        entry = self._entries.get(dataset_ref)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl_seconds:
+            return entry[1]
+        return None
+
+    def get_stale(self, dataset_ref):
+        """Retourne la liste en cache quel que soit son âge, ou None."""
+        entry = self._entries.get(dataset_ref)
+        return entry[1] if entry is not None else None
+
+    def set(self, dataset_ref, table_ids):
+        self._entries[dataset_ref] = (time.monotonic(), table_ids)
+
+    def invalidate(self, dataset_ref=None):
+        """Supprime une entrée du cache, ou tout le cache si aucun dataset n'est fourni."""
+        if dataset_ref is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(dataset_ref, None)
+
+
+def list_dataset_tables(client, dataset_ref, cache, page_size=LISTING_PAGE_SIZE):
+    """
+    Retourne les IDs des tables d'un dataset, depuis le cache si possible.
+
+    Args:
+        client: Client BigQuery.
+        dataset_ref: Référence complète du dataset (`project.dataset`).
+        cache: Instance de `DatasetTablesCache`.
+        page_size: Nombre de tables demandées par page à l'API.
+    """
+    table_ids = cache.get(dataset_ref)
+    if table_ids is not None:
+        return table_ids
+
+    def fetch(**kwargs):
+        # La pagination est consommée ici pour que les reprises la couvrent entièrement
+        return [
+            table.table_id
+            for table in client.list_tables(dataset_ref, page_size=page_size, **kwargs)
+        ]
+
+    return _fetch_cached(cache, dataset_ref, "list_tables", fetch)
+
+
+def list_project_datasets(client, project_id, cache, page_size=LISTING_PAGE_SIZE):
+    """
+    Retourne les IDs des datasets d'un projet, depuis le cache si possible.
+
+    Args:
+        client: Client BigQuery.
+        project_id: Projet à explorer.
+        cache: Instance de `DatasetTablesCache`.
+        page_size: Nombre de datasets demandés par page à l'API.
+    """
+    key = ("datasets", project_id)
+    dataset_ids = cache.get(key)
+    if dataset_ids is not None:
+        return dataset_ids
+
+    def fetch(**kwargs):
+        return [
+            dataset.dataset_id
+            for dataset in client.list_datasets(project=project_id, page_size=page_size, **kwargs)
+        ]
+
+    return _fetch_cached(cache, key, "list_datasets", fetch)
+
+
+def _fetch_cached(cache, key, endpoint, fetch):
+    """Appelle `fetch` (via la couche de résilience si configurée) et met le résultat en cache."""
+    if cache.resilience is None:
+        values = fetch()
+    else:
+        stale = cache.get_stale(key)
+        values = cache.resilience.call(
+            endpoint, fetch, retry=None, timeout=METADATA_CALL_TIMEOUT, fallback=lambda: stale
+        )
+        if stale is not None and values is stale:
+            # Liste périmée servie par le disjoncteur: ne pas rafraîchir l'entrée
+            return values
+    cache.set(key, values)
+    return values
+
+
+def list_all_tables(client, project_ids, cache, max_workers=LISTING_MAX_WORKERS,
+                    page_size=LISTING_PAGE_SIZE):
+    """
+    Liste les tables de tous les datasets des projets donnés, en parallèle.
+
+    Args:
+        client: Client BigQuery.
+        project_ids: Projets à explorer.
+        cache: Instance de `DatasetTablesCache`.
+        max_workers: Nombre maximal d'appels simultanés à l'API.
+        page_size: Nombre d'éléments demandés par page à l'API.
+
+    Returns:
+        Un tuple `(listing, errors)` où `listing` associe chaque `project.dataset`
+        à la liste de ses tables et `errors` associe chaque projet ou dataset
+        en échec au message d'erreur.
+    """
+    listing = {}
+    errors = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        dataset_futures = {
+            project_id: executor.submit(list_project_datasets, client, project_id, cache, page_size)
+            for project_id in project_ids
+        }
+
+        table_futures = {}
+        for project_id, future in dataset_futures.items():
+            try:
+                dataset_ids = future.result()
+            except Exception as e:
+                errors[project_id] = str(e)
+                continue
+            for dataset_id in dataset_ids:
+                dataset_ref = f"{project_id}.{dataset_id}"
+                table_futures[dataset_ref] = executor.submit(
+                    list_dataset_tables, client, dataset_ref, cache, page_size
+                )
+
+        for dataset_ref, future in table_futures.items():
+            try:
+                listing[dataset_ref] = future.result()
+            except Exception as e:
+                errors[dataset_ref] = str(e)
+
+    return listing, errors
+
+
+def collapse_shards(table_ids):
+    """
+    Regroupe les tables shardées par date en une seule entrée par famille.
+
+    Exemple: `events_20230101` ... `events_20231231` devient
+    `events_* (365 shards, 20230101–20231231)`. Une table datée isolée reste telle quelle.
+    """
+    families = {}
+    for table_id in table_ids:
+        match = _SHARD_RE.match(table_id)
+        if match:
+            families.setdefault(match.group(1), []).append(match.group(2))
+
+    entries = []
+    for table_id in table_ids:
+        match = _SHARD_RE.match(table_id)
+        suffixes = families.get(match.group(1)) if match else None
+        if not suffixes or len(suffixes) < 2:
+            entries.append(table_id)
+        elif match.group(2) == suffixes[0]:
+            # La famille est affichée à la place de son premier shard
+            entries.append(
+                f"{match.group(1)}* ({len(suffixes)} shards, {min(suffixes)}–{max(suffixes)})"
+            )
+    return entries
+
+
+def format_table_listing(listing, errors, max_tables=LISTING_MAX_TABLES_PER_DATASET):
+    """
+    Formate un listing multi-projets sous forme compacte (une ligne par dataset).
+
+    Les familles de shards sont regroupées et au plus `max_tables` entrées sont
+    affichées par dataset, suivies de `+N autres`.
+    """
+    table_count = sum(len(table_ids) for table_ids in listing.values())
+    lines = [f"{table_count} tables dans {len(listing)} datasets:"]
+    for dataset_ref in sorted(listing):
+        entries = collapse_shards(listing[dataset_ref])
+        if not entries:
+            lines.append(f"- {dataset_ref}: (vide)")
+            continue
+        shown = ", ".join(entries[:max_tables])
+        if len(entries) > max_tables:
+            shown += f", +{len(entries) - max_tables} autres"
+        lines.append(f"- {dataset_ref}: {shown}")
+    for ref in sorted(errors):
+        lines.append(f"- {ref}: erreur ({errors[ref]})")
+    return "\n".join(lines)
@@ -0,0 +1,79 @@
+from decimal import Decimal
+
+import pytest
+
+from src.dashboard_agent.codegen import extract_code_block, stream_code
+
+
+class FakeStream:
+    """Flux de tokens factice qui enregistre sa fermeture et les tokens consommés."""
+
+    def __init__(self, tokens):
+        self.tokens = list(tokens)
+        self.consumed = 0
+        self.closed = False
+
+    def __iter__(self):
+        for token in self.tokens:
+            self.consumed += 1
+            yield token
+
+    def close(self):
+        self.closed = True
+
+
+class FakeLLM:
+    def __init__(self, tokens):
+        self.stream_obj = FakeStream(tokens)
+
+    def stream(self, prompt):
+        return self.stream_obj
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("```python\nfig = 1\n```", "fig = 1"),
+    ("Voici le code:\n```py\nfig = 1\nfig.show()\n```\nBonne analyse", "fig = 1\nfig.show()"),
+    ("```\nfig = 1\n```", "fig = 1"),
+    ("```python\nfig = 1\n", None),
+    ("fig = 1", None),
+])
+def test_extract_code_block(text, expected):
+    assert extract_code_block(text) == expected
+
+
+def test_stream_code_stops_at_closed_block_and_closes_stream():
+    llm = FakeLLM(["```python\n", "fig = px.bar(df)\n", "```", "\nExplications", " inutiles"])
+
+    assert stream_code(llm, "prompt") == "fig = px.bar(df)"
+    assert llm.stream_obj.consumed == 3
+    assert llm.stream_obj.closed
+
+
+def test_stream_code_without_block_strips_fences():
+    llm = FakeLLM(["```python\n", "fig = 1", None])
+
+    assert stream_code(llm, "prompt") == "fig = 1"
+    assert llm.stream_obj.closed
+
+
+def test_prepare_dataframe_converts_types_and_keeps_rows_by_default():
+    pd = pytest.importorskip("pandas")
+    from src.dashboard_agent.preparation import prepare_dataframe
+
+    df = pd.DataFrame({"amount": [Decimal("1.5"), None, Decimal("2")], "label": ["a", "b", "c"]})
+    prepared = prepare_dataframe(df, max_rows=0)
+
+    assert len(prepared) == 3
+    assert str(prepared["amount"].dtype) == "float64"
+    assert prepared["label"].tolist() == ["a", "b", "c"]
+
+
+def test_prepare_dataframe_strides_in_result_order():
+    pd = pytest.importorskip("pandas")
+    from src.dashboard_agent.preparation import prepare_dataframe, sample_step
+
+    df = pd.DataFrame({"x": range(10)})
+    prepared = prepare_dataframe(df, max_rows=4)
+
+    assert sample_step(10, 4) == 3
+    assert prepared["x"].tolist() == [0, 3, 6, 9]
@@ -0,0 +1,161 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from src.resilience import CircuitOpenError, MetadataResilience, is_retryable
+from src.table_listing import DatasetTablesCache, list_dataset_tables, list_project_datasets
+
+
+class FakeApiError(Exception):
+    """Erreur au format `google.api_core`: code HTTP et raisons dans `errors`."""
+
+    def __init__(self, code, reason=None):
+        super().__init__("Exceeded rate limits: too many table update operations")
+        self.code = code
+        self.errors = [{"reason": reason, "message": str(self)}] if reason else []
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FaultyClient:
+    """Client BigQuery factice dont les appels échouent selon les pannes injectées."""
+
+    def __init__(self, faults=()):
+        self.faults = list(faults)
+        self.calls = []
+
+    def _maybe_fail(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.faults:
+            fault = self.faults.pop(0)
+            if fault is not None:
+                raise fault
+
+    def list_tables(self, dataset_ref, page_size=None, **kwargs):
+        self._maybe_fail(**kwargs)
+        return [SimpleNamespace(table_id="t1"), SimpleNamespace(table_id="t2")]
+
+    def list_datasets(self, project=None, page_size=None, **kwargs):
+        self._maybe_fail(**kwargs)
+        return [SimpleNamespace(dataset_id="d1")]
+
+
+def make_resilience(clock=None, sleeps=None, **kwargs):
+    kwargs.setdefault("hedge_percentile", None)
+    return MetadataResilience(
+        clock=clock or FakeClock(),
+        sleep=(sleeps.append if sleeps is not None else lambda delay: None),
+        rng=lambda: 1.0,
+        **kwargs,
+    )
+
+
+@pytest.mark.parametrize("error, expected", [
+    (FakeApiError(403, "rateLimitExceeded"), True),
+    (FakeApiError(403, "accessDenied"), False),
+    (FakeApiError(429), True),
+    (FakeApiError(503), True),
+    (FakeApiError(404, "notFound"), False),
+    (ConnectionError(), True),
+])
+def test_is_retryable(error, expected):
+    assert is_retryable(error) is expected
+
+
+def test_retries_with_exponential_backoff():
+    sleeps = []
+    resilience = make_resilience(sleeps=sleeps, base_delay=0.1, max_delay=0.3, max_attempts=4)
+    client = FaultyClient([FakeApiError(403, "rateLimitExceeded")] * 3)
+
+    assert list_dataset_tables(client, "p.d", DatasetTablesCache(resilience=resilience)) == ["t1", "t2"]
+    assert sleeps == pytest.approx([0.1, 0.2, 0.3])
+    # Les reprises internes de la bibliothèque sont désactivées
+    assert all(call["retry"] is None and call["timeout"] for call in client.calls)
+
+
+def test_non_retryable_error_is_raised_immediately():
+    client = FaultyClient([FakeApiError(404, "notFound")])
+    cache = DatasetTablesCache(resilience=make_resilience())
+
+    with pytest.raises(FakeApiError):
+        list_dataset_tables(client, "p.d", cache)
+    assert len(client.calls) == 1
+
+
+def test_breaker_opens_serves_stale_then_closes_after_trial():
+    clock = FakeClock()
+    resilience = make_resilience(clock=clock, max_attempts=1, failure_threshold=2, reset_seconds=10)
+    cache = DatasetTablesCache(ttl_seconds=0, resilience=resilience)
+    breaker_error = FakeApiError(503)
+
+    client = FaultyClient([None, breaker_error, breaker_error])
+    assert list_project_datasets(client, "p", cache) == ["d1"]
+    # Deux échecs: métadonnées périmées servies, puis ouverture du disjoncteur
+    assert list_project_datasets(client, "p", cache) == ["d1"]
+    assert list_project_datasets(client, "p", cache) == ["d1"]
+    assert resilience.breakers["list_datasets"].state == "open"
+
+    # Disjoncteur ouvert: aucun appel, cache servi, erreur sans cache
+    calls = len(client.calls)
+    assert list_project_datasets(client, "p", cache) == ["d1"]
+    with pytest.raises(CircuitOpenError):
+        list_project_datasets(client, "other", cache)
+    assert len(client.calls) == calls
+
+    # Semi-ouvert après le délai: l'appel d'essai réussi referme le disjoncteur
+    clock.now = 11
+    assert resilience.breakers["list_datasets"].state == "half-open"
+    assert list_project_datasets(client, "p", cache) == ["d1"]
+    assert resilience.breakers["list_datasets"].state == "closed"
+
+
+def test_failed_half_open_trial_reopens_breaker():
+    clock = FakeClock()
+    resilience = make_resilience(clock=clock, max_attempts=1, failure_threshold=1, reset_seconds=10)
+
+    def failing():
+        raise FakeApiError(503)
+
+    with pytest.raises(FakeApiError):
+        resilience.call("get_table", failing)
+    clock.now = 11
+    with pytest.raises(FakeApiError):
+        resilience.call("get_table", failing)
+    assert resilience.breakers["get_table"].state == "open"
+
+
+def test_slow_call_is_hedged_after_percentile_threshold():
+    resilience = make_resilience(hedge_percentile=0.95)
+    for _ in range(20):
+        resilience.call("get_table", lambda: "warmup")
+
+    release = threading.Event()
+    calls = []
+
+    def slow_then_fast():
+        calls.append(None)
+        if len(calls) == 1:
+            # La requête principale reste bloquée: seule la couverture peut répondre
+            release.wait(timeout=5)
+            return "primary"
+        return "hedge"
+
+    try:
+        assert resilience.call("get_table", slow_then_fast) == "hedge"
+        assert len(calls) == 2
+    finally:
+        release.set()
+
+
+def test_no_hedge_before_enough_samples():
+    resilience = make_resilience(hedge_percentile=0.95)
+    calls = []
+    resilience.call("get_table", lambda: calls.append(None))
+    assert len(calls) == 1
@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+
+from src.bigquery_agent.session import AgentSession, estimate_tokens
+
+
+def make_table(*columns, partition_field=None):
+    return SimpleNamespace(
+        schema=[SimpleNamespace(name=name, field_type="STRING") for name in columns],
+        time_partitioning=SimpleNamespace(field=partition_field, type_="DAY") if partition_field else None,
+        range_partitioning=None,
+        clustering_fields=None,
+    )
+
+
+def test_empty_session_has_no_context():
+    assert AgentSession().build_context("question") == ""
+
+
+def test_schemas_are_ranked_by_overlap_with_question():
+    session = AgentSession()
+    session.record_schema("p.shop.orders", make_table("order_id", "amount"))
+    session.record_schema("p.yt.video_stats", make_table("video_id", "views", partition_field="dt"))
+
+    context = session.build_context("nombre de views par video")
+    assert context.index("p.yt.video_stats [Partitionnement: dt (DAY)]") < context.index("p.shop.orders")
+
+
+def test_oversized_entry_does_not_hide_smaller_ones():
+    session = AgentSession(token_budget=40)
+    session.record_schema("p.d.wide", make_table(*[f"column_{i}" for i in range(50)]))
+    session.record_schema("p.d.small", make_table("id"))
+
+    context = session.build_context("wide small")
+    assert "p.d.small" in context
+    assert "p.d.wide" not in context
+
+
+def test_context_stays_within_token_budget():
+    session = AgentSession(token_budget=30)
+    for i in range(20):
+        session.record_tables(f"p.dataset_{i}", [f"table_{i}_a", f"table_{i}_b"])
+
+    context = session.build_context("tables")
+    entries = [line for line in context.splitlines() if line.startswith("- ")]
+    assert 0 < len(entries) < 20
+    assert sum(estimate_tokens(entry) for entry in entries) <= 30
+
+
+def test_previous_queries_are_kept_most_recent_first():
+    session = AgentSession()
+    for i in range(7):
+        session.current_question = f"question {i}"
+        session.record_query(f"SELECT {i}")
+
+    context = session.build_context("question")
+    assert "question 0" not in context and "question 1" not in context
+    assert context.index("SELECT 6") < context.index("SELECT 2")
@@ -0,0 +1,121 @@
+from types import SimpleNamespace
+
+import pytest
+
+from src.sql_analyzer import TableMetadataCache, analysis_view, analyze_sql
+
+
+def make_table(columns=("c1", "c2"), partition_field="event_date", require_filter=False):
+    schema = [SimpleNamespace(name=name, field_type="STRING", mode="NULLABLE") for name in columns]
+    return SimpleNamespace(
+        schema=schema,
+        time_partitioning=SimpleNamespace(field=partition_field, type_="DAY") if partition_field else None,
+        range_partitioning=None,
+        clustering_fields=None,
+        require_partition_filter=require_filter,
+    )
+
+
+class FakeClient:
+    project = "proj"
+
+    def __init__(self, table):
+        self.table = table
+
+    def get_table(self, full_table_id):
+        return self.table
+
+
+def analyze(sql, table=None, **kwargs):
+    client = FakeClient(table or make_table())
+    return analyze_sql(sql, client, TableMetadataCache(), **kwargs)
+
+
+def test_analysis_view_masks_literals_and_comments_with_same_length():
+    sql = "SELECT 'a--b', \"x\" -- note\nFROM `p.d.t` /* c */ # tail"
+    view = analysis_view(sql)
+    assert len(view) == len(sql)
+    assert "a--b" not in view and "note" not in view and "tail" not in view
+    assert "`p.d.t`" in view
+
+
+def test_preview_keeps_string_literal_containing_comment_marker():
+    sql = "SELECT c1 FROM ds.t WHERE c2='a--b' AND event_date > '2024-01-01'"
+    analysis = analyze(sql, preview=True)
+    assert analysis.sql == sql + "\nLIMIT 100"
+    assert analysis.warnings == []
+
+
+def test_partition_column_inside_literal_is_not_a_filter():
+    analysis = analyze("SELECT c1 FROM ds.t WHERE c1 = 'event_date'")
+    assert len(analysis.warnings) == 1
+
+
+def test_partition_column_in_comment_is_not_a_filter():
+    analysis = analyze("SELECT c1 FROM ds.t -- WHERE event_date > '2024'\n")
+    assert len(analysis.warnings) == 1
+
+
+@pytest.mark.parametrize("reject, require_filter", [(True, False), (False, True)])
+def test_unpruned_scan_is_rejected(reject, require_filter):
+    analysis = analyze(
+        "SELECT c1 FROM ds.t", make_table(require_filter=require_filter), reject_unpruned=reject
+    )
+    assert analysis.rejected
+    assert "event_date" in analysis.rejection_reason
+
+
+def test_non_preview_query_is_executed_unchanged():
+    sql = "SELECT c1 FROM ds.t WHERE event_date = '2024-01-01'; -- done"
+    assert analyze(sql).sql == sql
+
+
+def test_preview_rewrites_original_text_and_drops_trailing_semicolon():
+    table = make_table(columns=[f"c{i}" for i in range(5)], partition_field=None)
+    sql = "SELECT * FROM `proj.ds.t` WHERE c1 = '*' LIMIT 500; -- fin"
+    analysis = analyze(sql, table, preview=True, max_columns=2)
+    assert analysis.sql == "SELECT `c0`, `c1` FROM `proj.ds.t` WHERE c1 = '*' LIMIT 100"
+    assert len(analysis.rewrites) == 2
+
+
+def test_preview_keeps_smaller_limit():
+    sql = "SELECT c1 FROM ds.t WHERE event_date > '2024' LIMIT 5"
+    analysis = analyze(sql, preview=True)
+    assert analysis.sql == sql
+    assert analysis.rewrites == []
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT event_date, COUNT(*) FROM ds.t WHERE c1 = 'FR' GROUP BY event_date",
+    "SELECT c1 FROM ds.t WHERE c2 = 'x' ORDER BY event_date",
+    "SELECT c1 FROM ds.t WHERE event_date IS NOT NULL",
+    "SELECT c1 FROM (SELECT * FROM ds.t WHERE c1 = 'x') WHERE c2 > event_date_label",
+    "SELECT a.c1 FROM ds.t a JOIN ds.u b ON a.c1 = b.c1 WHERE b.event_date > '2024-01-01'",
+])
+def test_mentions_that_do_not_prune_partitions_are_warned(sql):
+    analysis = analyze(sql)
+    assert analysis.warnings and "proj.ds.t" in analysis.warnings[0]
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT c1 FROM ds.t WHERE event_date BETWEEN '2024-01-01' AND '2024-01-31'",
+    "SELECT c1 FROM ds.t WHERE event_date IN ('2024-01-01') GROUP BY c1",
+    "SELECT c1 FROM ds.t WHERE '2024-01-01' <= event_date",
+    "SELECT c1 FROM ds.t t WHERE DATE(t.event_date) = '2024-01-01'",
+    "SELECT a.c1 FROM ds.t AS a JOIN ds.u b ON a.c1 = b.c1 "
+    "WHERE a.event_date > '2024-01-01' AND b.event_date > '2024-01-01'",
+])
+def test_comparisons_on_partition_column_prune(sql):
+    assert analyze(sql).warnings == []
+
+
+@pytest.mark.parametrize("sql", [
+    "CREATE TABLE ds.copy AS SELECT * FROM ds.t WHERE event_date = '2024-01-01'",
+    "INSERT INTO ds.copy SELECT c1 FROM ds.t WHERE event_date = '2024-01-01'",
+    "DELETE FROM ds.t WHERE event_date = '2024-01-01'",
+    "UPDATE ds.t SET c1 = 'x' WHERE event_date = '2024-01-01'",
+])
+def test_preview_leaves_non_select_statements_untouched(sql):
+    analysis = analyze(sql, table=make_table(columns=[f"c{i}" for i in range(30)]), preview=True)
+    assert analysis.sql == sql
+    assert analysis.rewrites == ["Aperçu ignoré: seules les requêtes SELECT et WITH sont réécrites."]
@@ -0,0 +1,27 @@
+from src.table_listing import collapse_shards, format_table_listing
+
+
+def test_shard_families_are_collapsed():
+    table_ids = ["customers"] + [f"events_2023{month:02d}01" for month in range(1, 13)] + ["report_20240101"]
+
+    assert collapse_shards(table_ids) == [
+        "customers",
+        "events_* (12 shards, 20230101–20231201)",
+        "report_20240101",
+    ]
+
+
+def test_listing_is_capped_per_dataset():
+    listing = {
+        "p.big": [f"table_{i:03d}" for i in range(60)],
+        "p.empty": [],
+    }
+
+    text = format_table_listing(listing, {"p.broken": "403"}, max_tables=50)
+
+    lines = text.splitlines()
+    assert lines[0] == "60 tables dans 2 datasets:"
+    assert lines[1].endswith("table_049, +10 autres")
+    assert "table_050" not in text
+    assert lines[2] == "- p.empty: (vide)"
+    assert lines[3] == "- p.broken: erreur (403)"